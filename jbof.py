@@ -15,8 +15,10 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import numpy
-import uuid
+import os
+import secrets
 import json
+import concurrent.futures
 from pathlib import Path
 import shutil
 import hashlib
@@ -24,6 +26,76 @@ import soundfile
 import scipy.io
 import zipfile
 import io
+import weakref
+import collections
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _load_json(file):
+    """Parse JSON from an open file, with orjson if it is available."""
+    if orjson is not None:
+        return orjson.loads(file.read())
+    return json.load(file)
+
+
+def _dump_json(data, file, pretty=True):
+    """Write JSON to an open text file.
+
+    Always uses the stdlib encoder, so the written bytes (and with
+    them, dataset hashes) do not depend on installed libraries.
+    If `pretty` is false, skips indentation and key sorting, which is
+    faster but harder to read in a text editor.
+    """
+    if pretty:
+        json.dump(data, file, indent=2, sort_keys=True, default=_unwrap_numpy_types)
+    else:
+        json.dump(data, file, separators=(',', ':'), default=_unwrap_numpy_types)
+
+
+def _write_json_atomic(path, data, pretty=True):
+    """Write JSON to a temporary file, then atomically rename it into place.
+
+    A crash mid-write can then never leave a truncated metadata file
+    behind.
+    """
+    tmppath = path.with_name(path.name + '.tmp')
+    with tmppath.open('wt') as f:
+        _dump_json(data, f, pretty)
+    os.replace(tmppath, path)
+
+
+def _load_npy(filename, stem, metadata):
+    try:
+        return numpy.load(filename, mmap_mode='r')
+    except (ValueError, OSError): # zero-length arrays can not be mapped
+        return numpy.load(filename)
+
+
+def _load_audio(filename, stem, metadata):
+    data, samplerate = soundfile.read(filename)
+    metadata['samplerate'] = samplerate
+    return data
+
+
+def _load_mat(filename, stem, metadata):
+    # only parse the one variable we are going to keep:
+    return scipy.io.loadmat(filename, variable_names=[stem])[stem]
+
+
+_LOADERS = {'.npy': _load_npy,
+            '.wav': _load_audio,
+            '.flac': _load_audio,
+            '.ogg': _load_audio,
+            '.mat': _load_mat}
+
+
+def _new_hash(algorithm, data=b''):
+    """A hash for data integrity, not security (unlocks faster OpenSSL paths)."""
+    return hashlib.new(algorithm, data, usedforsecurity=False)
 
 
 def _unwrap_numpy_types(data):
@@ -61,8 +133,7 @@ def create_dataset(directory, metadata=None, itemformat=None):
     if directory.exists():
         raise TypeError(f'A directory with name {str(directory)} already exists')
     directory.mkdir()
-    with (directory / '_metadata.json').open('wt') as f:
-        json.dump(dict(metadata, _itemformat=itemformat), f, indent=2, sort_keys=True, default=_unwrap_numpy_types)
+    _write_json_atomic(directory / '_metadata.json', dict(metadata, _itemformat=itemformat))
     with (directory / '__init__.py').open('wt') as f:
         f.write('import jbof\n')
         f.write('dataset = jbof.DataSet(jbof.Path(__file__).parent)\n')
@@ -72,29 +143,59 @@ def create_dataset(directory, metadata=None, itemformat=None):
 class DataSet:
     """A structured collection of items that contain data."""
 
-    def __init__(self, directory, readonly=True):
+    def __init__(self, directory, readonly=True, pretty_json=True):
         directory = Path(directory)
         if not directory.exists():
             raise TypeError(f'DataSet directory {str(directory)} does not exist')
         if not directory.is_dir() and (directory / '_metadata.json').exists():
             raise TypeError(f'{str(directory)} does not seem to be a DataSet')
         self._directory = directory
+        self._directory_str = str(directory)
         self._readonly = readonly
-        self._cache = []
+        # set pretty_json=False for faster, whitespace-free metadata writes:
+        self._pretty_json = pretty_json
+        self._metadata_path = os.path.join(self._directory_str, '_metadata.json')
+        self._cache = {}
+        self._cache_complete = False
+        self._inverted = {}
+        self._metadata_cache = None
+        self._metadata_mtime = None
+        self._itemformat = None
+        self._itemformat_loaded = False
+        self._itemname_fn = None
+
+    def _load_metadata(self):
+        """The parsed `_metadata.json`, re-read only if the file changed on disk."""
+        mtime = os.stat(self._metadata_path).st_mtime_ns
+        if self._metadata_cache is None or mtime != self._metadata_mtime:
+            with open(self._metadata_path) as f:
+                self._metadata_cache = _load_json(f)
+            self._metadata_mtime = mtime
+        return self._metadata_cache
+
+    def _invalidate_metadata(self):
+        """Forget the cached `_metadata.json`, so it is re-read on next access."""
+        self._metadata_cache = None
+        self._metadata_mtime = None
 
     @property
     def itemformat(self):
-        """The ``str.format`` format string for generating item names from metadata."""
-        with (self._directory / '_metadata.json').open() as f:
-            return json.load(f)['_itemformat']
+        """The ``str.format`` format string for generating item names from metadata.
+
+        Read from disk once; the itemformat of an existing dataset
+        never changes.
+        """
+        if not self._itemformat_loaded:
+            self._itemformat = self._load_metadata()['_itemformat']
+            self._itemformat_loaded = True
+        return self._itemformat
 
     @property
     def metadata(self):
         """The Dataset's metadata dict."""
-        with (self._directory / '_metadata.json').open() as f:
-            metadata = json.load(f)
-            del metadata['_itemformat']
-            return metadata
+        metadata = dict(self._load_metadata())
+        del metadata['_itemformat']
+        return metadata
 
     @property
     def name(self):
@@ -102,29 +203,70 @@ class DataSet:
         return self._directory.name
 
     def _itemname(self, metadata):
-        itemformat = self.itemformat
-        if isinstance(itemformat, str) and '{' in itemformat:
-            return itemformat.format(**metadata)
-        elif itemformat is None:
-            return str(uuid.uuid1())
-        else:
-            return TypeError(f'itemname must be None, or format string, not {itemformat}')
+        if self._itemname_fn is None:
+            itemformat = self.itemformat
+            if isinstance(itemformat, str) and '{' in itemformat:
+                # format_map saves the metadata dict copy that .format(**...) makes:
+                self._itemname_fn = itemformat.format_map
+            elif itemformat is None:
+                self._itemname_fn = lambda metadata: secrets.token_hex(8)
+            else:
+                raise TypeError(f'itemname must be None, or format string, not {itemformat}')
+        return self._itemname_fn(metadata)
 
     def all_items(self):
         """A generator that returns all items."""
 
-        if self._cache:
-            yield from self._cache
+        if self._cache_complete:
+            yield from self._cache.values()
         else:
-            cache = []
-            for dir in self._directory.iterdir():
-                if not dir.is_dir() or dir.stem == '__pycache__':
-                    continue
-                item = Item(dir, self._readonly)
-                cache.append(item)
-                yield item
-            else: # if all items were traversed:
-                self._cache = cache
+            cache = {}
+            with os.scandir(self._directory) as entries:
+                for entry in entries:
+                    if not entry.is_dir(follow_symlinks=False) or entry.name == '__pycache__':
+                        continue
+                    item = self._cache.get(entry.name)
+                    if item is None:
+                        item = Item(Path(entry.path), self._readonly,
+                                    pretty_json=self._pretty_json)
+                    cache[entry.name] = item
+                    yield item
+                else: # if all items were traversed:
+                    self._cache = cache
+                    self._cache_complete = True
+
+    def build_index(self):
+        """Write `_index.json`, a rolled-up copy of all item metadata.
+
+        With an index, `find_items` answers queries from one file
+        instead of opening every item's `_metadata.json`. The index
+        becomes stale when items are added or deleted, and is then
+        rebuilt on the next `find_items` call (or ignored, if the
+        DataSet is read-only).
+        """
+        index = {item.name: item.metadata for item in self.all_items()}
+        # the index is only ever read by machines, so write it compactly:
+        _write_json_atomic(self._directory / '_index.json', index, pretty=False)
+        return index
+
+    def _load_index(self):
+        """The parsed `_index.json`, or None if it is absent or stale.
+
+        The index is stale if the item directories do not match the
+        indexed names anymore, i.e. if items were added or deleted
+        since it was written.
+        """
+        try:
+            with (self._directory / '_index.json').open() as f:
+                index = _load_json(f)
+        except FileNotFoundError:
+            return None
+        with os.scandir(self._directory) as entries:
+            names = {entry.name for entry in entries
+                     if entry.is_dir(follow_symlinks=False) and entry.name != '__pycache__'}
+        if names != index.keys():
+            return None
+        return index
 
     def find_items(self, **query):
         """Search for items that match `query`.
@@ -144,22 +286,135 @@ class DataSet:
         and will run faster.
 
         """
+        # tuples, not sets: `in` on a tuple compares without hashing,
+        # so unhashable metadata values (e.g. lists) simply never match:
+        compiled = [(key, (value,) if isinstance(value, str) else tuple(value))
+                    for key, value in query.items()]
+        # only the directory-backed DataSet has an item cache to seed:
+        if hasattr(self, '_directory') and not self._cache_complete:
+            index = self._load_index()
+            if index is None and not self._readonly:
+                index = self.build_index()
+            if index is not None:
+                items = {}
+                for name, metadata in index.items():
+                    items[name] = Item(self._directory / name, self._readonly,
+                                       metadata=metadata,
+                                       pretty_json=self._pretty_json)
+                self._cache = items
+                self._cache_complete = True
+        # with a complete item cache, answer from the inverted index:
+        if compiled and hasattr(self, '_inverted') and self._cache_complete:
+            for key, _ in compiled:
+                if key not in self._inverted:
+                    self._inverted[key] = self._invert(key)
+            if all(self._inverted[key] is not None for key, _ in compiled):
+                matches = None
+                for key, values in compiled:
+                    names = set()
+                    for value in values:
+                        names |= self._inverted[key].get(value, set())
+                    matches = names if matches is None else matches & names
+                for name in matches:
+                    yield self._cache[name]
+                return
         for item in self.all_items():
-            for key, value in query.items():
-                if isinstance(value, str):
-                    value = [value]
-                if key not in item.metadata or item.metadata[key] not in value:
-                    break
-            else:
+            metadata = item.metadata
+            if all(metadata.get(key) in values for key, values in compiled):
                 yield item
 
+    def _invert(self, key):
+        """Map each value of metadata `key` to the set of item names using it.
+
+        Returns None if any item's value is unhashable (e.g. a list),
+        in which case queries on `key` fall back to the linear scan.
+        """
+        inverted = {}
+        for name, item in self._cache.items():
+            try:
+                inverted.setdefault(item.metadata.get(key), set()).add(name)
+            except TypeError:
+                return None
+        return inverted
+
+    def _inverted_add(self, name, metadata):
+        """Register a new item with the already-indexed metadata keys."""
+        for key, inverted in self._inverted.items():
+            if inverted is None:
+                continue
+            try:
+                inverted.setdefault(metadata.get(key), set()).add(name)
+            except TypeError:
+                self._inverted[key] = None
+
+    def _inverted_discard(self, name):
+        """Remove a deleted item from all indexed metadata keys."""
+        for inverted in self._inverted.values():
+            if inverted is None:
+                continue
+            for names in inverted.values():
+                names.discard(name)
+
+    def prefetch(self, max_workers=16, arrays=False):
+        """Load all item metadata concurrently with a thread pool.
+
+        On high-latency file systems (NFS, SMB), this warms the
+        metadata caches much faster than the sequential walk that
+        `find_items` would otherwise do on first use. With
+        ``arrays=True``, the array sidecar files are read as well;
+        the array data itself always stays lazy.
+        """
+        items = list(self.all_items())
+
+        def warm(item):
+            item.metadata
+            if arrays:
+                for name, array in item.all_arrays():
+                    array.metadata
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for _ in pool.map(warm, items):
+                pass
+
     def find_one_item(self, **query):
         """Search for items that match `query`.
 
         See `find_items` for details.
         """
-        for item in self.find_items(**query):
-            return item
+        return next(self.find_items(**query), None)
+
+    def to_table(self):
+        """All array metadata as a dict of numpy columns, one row per array.
+
+        Returns the columns ``item``, ``array`` and ``_filename``, plus
+        one column per metadata key seen on any array (None where an
+        array has no such key). Metadata keys that collide with the
+        fixed columns raise a TypeError. A columnar layout makes bulk
+        filtering a vectorized numpy operation instead of a Python
+        loop over items and arrays.
+        """
+        reserved = ('item', 'array', '_filename')
+        rows = []
+        keys = []
+        for item in self.all_items():
+            for name, array in item.all_arrays():
+                metadata = array.metadata
+                rows.append((item.name, name, array._filename, metadata))
+                for key in metadata:
+                    if key in reserved:
+                        raise TypeError(f'metadata key {key} collides with a '
+                                        f'table column')
+                    if key not in keys:
+                        keys.append(key)
+        columns = {
+            'item': [itemname for itemname, _, _, _ in rows],
+            'array': [arrayname for _, arrayname, _, _ in rows],
+            '_filename': [filename for _, _, filename, _ in rows],
+        }
+        for key in keys:
+            columns[key] = [metadata.get(key) for _, _, _, metadata in rows]
+        return {key: numpy.array(values, dtype=object)
+                for key, values in columns.items()}
 
     def add_item(self, name=None, metadata=None):
         """Add a new, empty item."""
@@ -177,78 +432,155 @@ class DataSet:
             raise TypeError(f'Item with name {str(dirname)} already exists')
 
         (self._directory / dirname).mkdir()
-        with (self._directory / dirname / '_metadata.json').open('wt') as f:
-            json.dump(metadata, f, indent=2, sort_keys=True, default=_unwrap_numpy_types)
+        _write_json_atomic(self._directory / dirname / '_metadata.json', metadata,
+                           pretty=self._pretty_json)
 
-        item = Item(self._directory / dirname, self._readonly)
-        if self._cache:
-            self._cache.append(item)
+        item = Item(self._directory / dirname, self._readonly,
+                    pretty_json=self._pretty_json)
+        self._cache[dirname] = item
+        self._inverted_add(dirname, metadata)
         return item
 
+    def add_items(self, items, max_workers=16):
+        """Add many new, empty items.
+
+        `items` is an iterable of ``(name, metadata)`` pairs, where
+        either may be None as in `add_item`. The item directories and
+        metadata files are written concurrently, which hides file
+        system latency for large batches.
+
+        Returns a list of the new items.
+        """
+        if self._readonly:
+            raise RuntimeError('DataSet is read-only')
+        specs = []
+        seen = set()
+        for name, metadata in items:
+            dirname = self._itemname(metadata) if name is None else str(name)
+            if metadata is None:
+                metadata = {}
+            if dirname in seen or self.has_item(dirname):
+                raise TypeError(f'Item with name {str(dirname)} already exists')
+            seen.add(dirname)
+            specs.append((dirname, metadata))
+
+        def write_item(spec):
+            dirname, metadata = spec
+            (self._directory / dirname).mkdir()
+            _write_json_atomic(self._directory / dirname / '_metadata.json', metadata,
+                               pretty=self._pretty_json)
+            return Item(self._directory / dirname, self._readonly,
+                        pretty_json=self._pretty_json)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+            new_items = list(pool.map(write_item, specs))
+        for item, (dirname, metadata) in zip(new_items, specs):
+            self._cache[dirname] = item
+            self._inverted_add(dirname, metadata)
+        return new_items
+
     def has_item(self, name):
         """Check if item of name exists.
 
         Or use ``name in dataset`` instead.
         """
-        return (self._directory / name).exists()
+        return name in self._cache or os.path.exists(os.path.join(self._directory_str, name))
 
     def __contains__(self, name):
         return self.has_item(name)
 
     def get_item(self, name):
         """Get an item by name."""
+        item = self._cache.get(name)
+        if item is not None:
+            return item
         if not self.has_item(name):
             raise TypeError(f'no item {name}')
-        return Item(self._directory / name, self._readonly)
+        item = Item(self._directory / name, self._readonly,
+                    pretty_json=self._pretty_json)
+        self._cache[name] = item
+        return item
 
     def __getitem__(self, name):
         return self.get_item(name)
 
     def delete_item(self, item):
-        """Deletes item permanently from the hard drive.
-
-        This invalidates the ``find_items`` cache.
-        """
+        """Deletes item permanently from the hard drive."""
         if self._readonly:
             raise RuntimeError('DataSet is read-only')
         if isinstance(item, str):
             item = self.get_item(item)
         if not isinstance(item, Item):
             raise TypeError('item must be of type Item or str')
-        self._cache = [] # invalidate cache
+        self._cache.pop(item.name, None) # only this item's cache entry is stale
+        self._inverted_discard(item.name)
         shutil.rmtree(item._directory)
         item._directory = None
 
-    def calculate_hash(self):
-        """Calculates an md5 hash of all data."""
-        itemhashes = []
-        for item in self.all_items():
-            filehashes = []
-            for file in item._directory.iterdir():
-                with file.open('br') as f:
-                    filehashes.append(hashlib.md5(f.read()).digest())
-            filehashes = sorted(filehashes)
-            itemhashes.append(hashlib.md5(b''.join(filehashes)).digest())
-        itemhashes = sorted(itemhashes)
-        return hashlib.md5(b''.join(itemhashes)).hexdigest()
+    def _hash_item(self, item, algorithm):
+        """Hash one item as the hash of its sorted per-file digests."""
+        filehashes = []
+        # one reusable buffer, instead of one bytes object per read:
+        buffer = bytearray(1024 * 1024)
+        view = memoryview(buffer)
+        with os.scandir(item._directory) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                filehash = _new_hash(algorithm)
+                with open(entry.path, 'rb', buffering=0) as f:
+                    while numread := f.readinto(buffer):
+                        filehash.update(view[:numread])
+                filehashes.append(filehash.digest())
+        filehashes.sort()
+        itemhash = _new_hash(algorithm)
+        for digest in filehashes:
+            itemhash.update(digest)
+        return itemhash.digest()
+
+    def calculate_hash(self, algorithm='md5'):
+        """Calculates a hash of all data.
+
+        `algorithm` can be any algorithm known to `hashlib`; 'blake2b'
+        is typically two to three times faster than the default 'md5',
+        which is retained so that existing dataset hashes stay valid.
+
+        Items are hashed concurrently in a thread pool, since both
+        file reads and hashlib release the GIL.
+        """
+        max_workers = min(32, (os.cpu_count() or 1) * 4)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+            itemhashes = list(pool.map(lambda item: self._hash_item(item, algorithm),
+                                       self.all_items()))
+        itemhashes.sort()
+        datasethash = _new_hash(algorithm)
+        for digest in itemhashes:
+            datasethash.update(digest)
+        return datasethash.hexdigest()
 
 
 class Item:
     """A collection of arrays in a dataset."""
 
-    def __init__(self, directory, readonly):
+    def __init__(self, directory, readonly, metadata=None, pretty_json=True):
         self._directory = directory
+        self._directory_str = str(directory)
+        # normalized once, so __eq__/__hash__ need no further syscalls:
+        self._key = os.path.realpath(self._directory_str)
         self._readonly = readonly
-        self._metadata_cache = None
-        self._array_cache = {}
+        self._pretty_json = pretty_json
+        self._metadata_cache = metadata
+        self._array_names = None
+        # hold loaded arrays only as long as the caller does:
+        self._array_cache = weakref.WeakValueDictionary()
 
     @property
     def metadata(self):
         """The item's metadata dict."""
         # use hasattr for compatibility with older, pickled Items:
-        if not hasattr(self, '_metadata_cache') or not self._metadata_cache:
-            with (self._directory / '_metadata.json').open() as f:
-                self._metadata_cache = json.load(f)
+        if not hasattr(self, '_metadata_cache') or self._metadata_cache is None:
+            with open(os.path.join(self._directory_str, '_metadata.json')) as f:
+                self._metadata_cache = _load_json(f)
         return self._metadata_cache
 
     @property
@@ -257,13 +589,33 @@ class Item:
         return self._directory.name
 
     def __getattr__(self, name):
-        if name in ['__getstate__', '_directory', '_readonly', '_metadata_cache', '_array_cache']:
-            raise AttributeError()
+        if name == '_directory_str':
+            # for compatibility with older, pickled Items:
+            self._directory_str = str(self._directory)
+            return self._directory_str
+        if name == '_key':
+            # for compatibility with older, pickled Items:
+            self._key = os.path.realpath(str(self._directory))
+            return self._key
+        if name == '_pretty_json':
+            # for compatibility with older, pickled Items:
+            self._pretty_json = True
+            return self._pretty_json
+        if name == '_array_names':
+            # for compatibility with older, pickled Items:
+            self._array_names = None
+            return self._array_names
+        if name.startswith('_'):
+            # fail fast on pickle/copy/introspection probes:
+            raise AttributeError(name)
+        array = self._array_cache.get(name)
+        if array is not None:
+            return array
         if not self.has_array(name):
-            raise TypeError(f'no array {name}')
-        if name not in self._array_cache:
-            self._array_cache[name] = Array(self._directory / (name + '.json'))
-        return self._array_cache[name]
+            raise AttributeError(f'no array {name}')
+        array = LazyArray(os.path.join(self._directory_str, f'{name}.json'))
+        self._array_cache[name] = array
+        return array
 
     def __getstate__(self):
         state = self.__dict__
@@ -272,17 +624,28 @@ class Item:
         return state
 
     def __eq__(self, other):
-        return self._directory.samefile(other._directory)
+        return isinstance(other, Item) and self._key == other._key
 
     def __hash__(self):
-        return hash(self._directory / '_metadata.json')
+        return hash(self._key)
 
     def all_arrays(self):
-        """A generator that returns all arrays as name-value pairs."""
-        for meta in self._directory.glob('*.json'):
-            if meta.stem == '_metadata':
-                continue
-            yield meta.stem, getattribute(self, meta.stem)
+        """A generator that returns all arrays as name-value pairs.
+
+        Arrays are returned as `LazyArray`, and are only loaded from
+        disk when they are used.
+        """
+        for name in list(self._load_array_names()):
+            yield name, getattr(self, name)
+
+    def _load_array_names(self):
+        """The set of array names, gathered from one directory scan."""
+        if self._array_names is None:
+            with os.scandir(self._directory_str) as entries:
+                self._array_names = {
+                    entry.name[:-len('.json')] for entry in entries
+                    if entry.name.endswith('.json') and entry.name != '_metadata.json'}
+        return self._array_names
 
     def add_array_from_file(self, name, filename, metadata=None):
         """Add a new array from an existing file.
@@ -298,23 +661,27 @@ class Item:
         if metadata is None:
             metadata = {}
         filename = Path(filename)
-        if not filename.exists():
+        if not os.path.exists(filename):
             raise TypeError(f'File {filename} does not exist')
         if filename.suffix in ['.wav', '.flac', '.ogg']:
-            with soundfile.SoundFile(str(filename)) as f:
-                metadata = dict(metadata, samplerate=f.samplerate)
+            # soundfile.info only parses the header, without opening a decoder:
+            metadata = dict(metadata, samplerate=soundfile.info(str(filename)).samplerate)
 
-        arrayfilename = self._directory / (name + filename.suffix)
-        if arrayfilename.exists():
+        arrayfilename = self._directory / f'{name}{filename.suffix}'
+        if os.path.exists(arrayfilename):
             raise TypeError(f'Array with name {arrayfilename.name} already exists')
 
-        shutil.copy(filename, arrayfilename)
+        tmpfilename = arrayfilename.with_name(arrayfilename.name + '.tmp')
+        shutil.copy(filename, tmpfilename)
+        os.replace(tmpfilename, arrayfilename)
 
-        metafilename = self._directory / (name + '.json')
-        with metafilename.open('wt') as f:
-            json.dump(dict(metadata, _filename=arrayfilename.name), f, indent=2, sort_keys=True, default=_unwrap_numpy_types)
+        metafilename = self._directory / f'{name}.json'
+        _write_json_atomic(metafilename, dict(metadata, _filename=arrayfilename.name),
+                           pretty=self._pretty_json)
 
-        return Array(metafilename)
+        if self._array_names is not None:
+            self._array_names.add(name)
+        return LazyArray(metafilename)
 
     def add_array(self, name, data, metadata=None, fileformat='npy', samplerate=None):
         """Add a new array.
@@ -330,69 +697,84 @@ class Item:
             raise RuntimeError('DataSet is read-only')
         if metadata is None:
             metadata = {}
-        arrayfilename = self._directory / (name + '.' + fileformat)
-        if arrayfilename.exists():
+        arrayfilename = self._directory / f'{name}.{fileformat}'
+        if os.path.exists(arrayfilename):
             raise TypeError(f'Array with name {arrayfilename.name} already exists')
+        tmpfilename = arrayfilename.with_name(arrayfilename.name + '.tmp')
         if fileformat == 'npy':
-            numpy.save(arrayfilename, data)
+            with tmpfilename.open('wb') as f:
+                # same bytes as numpy.save, minus the pickle machinery:
+                numpy.lib.format.write_array(f, numpy.asarray(data),
+                                             allow_pickle=False)
         elif fileformat in ['wav', 'flac', 'ogg']:
             if samplerate:
-                soundfile.write(str(arrayfilename), data, int(samplerate))
+                soundfile.write(str(tmpfilename), data, int(samplerate), format=fileformat)
                 metadata = dict(metadata, samplerate=samplerate)
             else:
                 raise TypeError(f'Samplerate must be given for fileformat {fileformat}.')
         elif fileformat == 'mat':
-            scipy.io.savemat(str(arrayfilename), dict([(name, data)]))
+            with tmpfilename.open('wb') as f:
+                scipy.io.savemat(f, dict([(name, data)]))
         else:
             raise NotImplementedError(f'Fileformat {fileformat} not supported.')
+        os.replace(tmpfilename, arrayfilename)
 
-        metafilename = (self._directory / (name + '.json'))
-        with metafilename.open('wt') as f:
-            json.dump(dict(metadata, _filename=arrayfilename.name), f, indent=2, sort_keys=True, default=_unwrap_numpy_types)
+        metafilename = self._directory / f'{name}.json'
+        _write_json_atomic(metafilename, dict(metadata, _filename=arrayfilename.name),
+                           pretty=self._pretty_json)
 
-        return Array(metafilename)
+        if self._array_names is not None:
+            self._array_names.add(name)
+        return LazyArray(metafilename)
 
     def delete_array(self, array):
         """Deletes array permanently from the hard drive."""
         if self._readonly:
             raise RuntimeError('DataSet is read-only')
-        if not isinstance(array, Array):
+        if not isinstance(array, (Array, LazyArray)):
             raise TypeError('array must be of type Array')
-        arrayfilename = Path(array._filename)
+        # Use Path(...).name for compatibility with earlier version
+        # that stored more than just the name:
+        arrayfilename = self._directory / Path(array._filename).name
         metafilename = arrayfilename.with_suffix('.json')
         arrayfilename.unlink()
         metafilename.unlink()
-        if metafilename in self._array_cache:
-            del self._array_cache[arrayfilename.stem]
+        self._array_cache.pop(arrayfilename.stem, None)
+        if self._array_names is not None:
+            self._array_names.discard(arrayfilename.stem)
 
     def has_array(self, name):
         """Check if array of name exists.
 
         Or use ``name in item`` instead.
         """
-        return (self._directory / (name + '.json')).is_file()
+        if name in self._load_array_names():
+            return True
+        # the name set can miss arrays added by other processes:
+        if os.path.isfile(os.path.join(self._directory_str, f'{name}.json')):
+            self._array_names.add(name)
+            return True
+        return False
 
     def __contains__(self, name):
         return self.has_array(name)
 
 
 class Array(numpy.ndarray):
-    """A subclass of numpy.ndarray with a `_filename` and `metadata`."""
+    """A subclass of numpy.ndarray with a `_filename` and `metadata`.
+
+    ``.npy`` data is memory-mapped read-only, so only the accessed
+    pages are read from disk. Use ``numpy.copy`` if you need a
+    writeable array.
+    """
     def __new__(cls, metafile):
-        with metafile.open() as f:
-            metadata = json.load(f)
-        extension = Path(metadata['_filename']).suffix.lower()
+        with open(metafile) as f:
+            metadata = _load_json(f)
         # Use Path(...).name for compatibility with earlier version
         # that stored more than just the name:
-        filename = metafile.parent / Path(metadata['_filename']).name
-        if extension == '.npy':
-            data = numpy.load(filename)
-        elif extension in ['.wav', '.flac', '.ogg']:
-            data, samplerate = soundfile.read(str(filename))
-            metadata['samplerate'] = samplerate
-        elif extension == '.mat':
-            data = scipy.io.loadmat(filename)
-            data = data[filename.stem]
+        stored = Path(metadata['_filename'])
+        filename = os.path.join(os.path.dirname(os.fspath(metafile)), stored.name)
+        data = _LOADERS[stored.suffix.lower()](filename, stored.stem, metadata)
         obj = numpy.asarray(data).view(cls)
         obj._filename = metadata['_filename']
         del metadata['_filename']
@@ -405,21 +787,85 @@ class Array(numpy.ndarray):
         self._filename = getattr(obj, '_filename', None)
 
 
+class LazyArray:
+    """A placeholder for an `Array` that defers loading the data.
+
+    Accessing `metadata` or `_filename` only parses the small JSON
+    sidecar file; any use as an array loads the actual data, once.
+    """
+
+    def __init__(self, metafile):
+        self._metafile = metafile
+        self._array = None
+        self._sidecar = None
+
+    def _load(self):
+        if self._array is None:
+            self._array = Array(self._metafile)
+        return self._array
+
+    def _load_sidecar(self):
+        if self._sidecar is None:
+            with open(self._metafile) as f:
+                self._sidecar = _load_json(f)
+        return self._sidecar
+
+    @property
+    def metadata(self):
+        if self._array is not None:
+            return self._array.metadata
+        metadata = dict(self._load_sidecar())
+        del metadata['_filename']
+        return metadata
+
+    @property
+    def _filename(self):
+        return self._load_sidecar()['_filename']
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            # fail fast on pickle/copy/introspection probes:
+            raise AttributeError(name)
+        return getattr(self._load(), name)
+
+    def __reduce__(self):
+        # unpickle as a fresh, unloaded proxy for the same sidecar:
+        return (type(self), (self._metafile,))
+
+    def __array__(self, dtype=None):
+        array = self._load()
+        return numpy.asarray(array) if dtype is None else numpy.asarray(array, dtype)
+
+    def __getitem__(self, index):
+        return self._load()[index]
+
+    def __len__(self):
+        return len(self._load())
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __eq__(self, other):
+        return self._load() == other
+
+    def __repr__(self):
+        return repr(self._load())
+
+
 def dataset_to_hdf(dataset, hdffilename):
     """Convert the dataset to HDF5."""
     import h5py
 
-    file = h5py.File(hdffilename, 'w')
-    for k, v in dataset.metadata.items():
-        file.attrs[k] = v
+    # libver='latest' uses the faster, non-backwards-compatible attribute layout:
+    file = h5py.File(hdffilename, 'w', libver='latest')
+    file.attrs.update(dataset.metadata)
     for item in dataset.all_items():
         grp = file.create_group(item.name)
-        for k, v in item.metadata.items():
-            grp.attrs[k] = v
+        grp.attrs.update(item.metadata)
         for name, array in item.all_arrays():
+            # npy arrays are memmapped, so h5py streams them from disk:
             dset = grp.create_dataset(name, data=array)
-            for k, v in array.metadata.items():
-                dset.attrs[k] = v
+            dset.attrs.update(array.metadata)
             dset.attrs['_filename'] = array._filename
     file.close()
 
@@ -441,10 +887,13 @@ class HDFDataSet(DataSet):
         import h5py
         self._file = h5py.File(filename, 'r')
         self._readonly = True
+        self._metadata_cache = None
 
     @property
     def metadata(self):
-        return dict(self._file.attrs)
+        if self._metadata_cache is None:
+            self._metadata_cache = dict(self._file.attrs)
+        return dict(self._metadata_cache)
 
     def all_items(self):
         """A generator that returns all items."""
@@ -461,8 +910,8 @@ class HDFDataSet(DataSet):
             raise TypeError(f'no item {name}')
         return HDFItem(self._file[name])
 
-    def calculate_hash(self):
-        """Calculates an md5 hash of all data."""
+    def calculate_hash(self, algorithm='md5'):
+        """Calculates a hash of all data."""
         raise NotImplementedError('Can not calculate hash of HDF DataSet')
 
 
@@ -470,17 +919,22 @@ class HDFItem(Item):
     def __init__(self, group):
         self._group = group
         self._readonly = True
+        self._metadata_cache = None
 
     @property
     def metadata(self):
-        return dict(self._group.attrs)
+        if self._metadata_cache is None:
+            self._metadata_cache = dict(self._group.attrs)
+        return dict(self._metadata_cache)
 
     @property
     def name(self):
         return Path(self._group.name).name
 
     def __getattr__(self, name):
-        return HDFArray(self.group[name])
+        if name.startswith('_') or name not in self._group:
+            raise AttributeError(name)
+        return HDFArray(self._group[name])
 
     def __eq__(self, other):
         return self._group == other._group
@@ -511,27 +965,34 @@ class ZIPDataSet(DataSet):
 
     def __init__(self, filename):
         self._zipfile = zipfile.ZipFile(filename, 'r')
-        self._filetree = {}
+        # bucket all entries by their parent directory in one pass:
+        buckets = collections.defaultdict(dict)
         for info in self._zipfile.infolist():
-            if info.is_dir() or '__pycache__' in info.filename:
+            if info.filename.endswith('/') or '__pycache__' in info.filename:
                 continue
-            *parts, name = info.filename.split('/')
+            parent, _, name = info.filename.rpartition('/')
+            buckets[parent][name] = info
+        # then wire each unique parent path into a nested tree:
+        self._filetree = {}
+        for parent, files in buckets.items():
             dir = self._filetree
-            for part in parts:
-                if part not in dir:
-                    dir[part] = {}
-                dir = dir[part]
-            dir[name] = info
+            if parent:
+                for part in parent.split('/'):
+                    dir = dir.setdefault(part, {})
+            dir.update(files)
         while len(self._filetree) == 1:
             self._filetree = self._filetree[list(self._filetree.keys())[0]]
         self._readonly = True
+        self._metadata_cache = None
 
     @property
     def metadata(self):
-        with self._zipfile.open(self._filetree['_metadata.json'].filename) as f:
-            metadata = json.load(f)
-            del metadata['_itemformat']
-            return metadata
+        if self._metadata_cache is None:
+            with self._zipfile.open(self._filetree['_metadata.json'].filename) as f:
+                self._metadata_cache = _load_json(f)
+        metadata = dict(self._metadata_cache)
+        del metadata['_itemformat']
+        return metadata
 
     def all_items(self):
         """A generator that returns all items."""
@@ -551,8 +1012,8 @@ class ZIPDataSet(DataSet):
             raise TypeError(f'no item {name}')
         return ZIPItem(self._zipfile, name, self._filetree[name])
 
-    def calculate_hash(self):
-        """Calculates an md5 hash of all data."""
+    def calculate_hash(self, algorithm='md5'):
+        """Calculates a hash of all data."""
         raise NotImplementedError('Can not calculate hash of ZIP DataSet')
 
 
@@ -562,17 +1023,22 @@ class ZIPItem(Item):
         self._directory = directory
         self._filetree = filetree
         self._readonly = True
+        self._metadata_cache = None
 
     @property
     def metadata(self):
-        with self._zipfile.open(self._filetree['_metadata.json'].filename) as f:
-            return json.load(f)
+        if self._metadata_cache is None:
+            with self._zipfile.open(self._filetree['_metadata.json'].filename) as f:
+                self._metadata_cache = _load_json(f)
+        return self._metadata_cache
 
     @property
     def name(self):
         return self._directory
 
     def __getattr__(self, name):
+        if name.startswith('_') or name + '.json' not in self._filetree:
+            raise AttributeError(name)
         return ZIPArray(self._zipfile, self._filetree[name + '.json'])
 
     def __eq__(self, other):
@@ -595,18 +1061,24 @@ class ZIPArray(Array):
     """A subclass of numpy.ndarray with a `_filename` and `metadata`."""
     def __new__(cls, zipfile, fileinfo):
         with zipfile.open(fileinfo.filename) as f:
-            metadata = json.load(f)
-        extension = Path(metadata['_filename']).suffix
-        with zipfile.open(metadata['_filename']) as f:
-            f = io.BytesIO(f.read())
+            metadata = _load_json(f)
+        # the data member lives next to its sidecar within the archive:
+        stored = Path(metadata['_filename'])
+        parent, _, _ = fileinfo.filename.rpartition('/')
+        member = f'{parent}/{stored.name}' if parent else stored.name
+        extension = stored.suffix.lower()
+        with zipfile.open(member) as f:
             if extension == '.npy':
+                # numpy.load reads sequentially, so no buffer copy is needed:
                 data = numpy.load(f)
             elif extension in ['.wav', '.flac', '.ogg']:
-                data, _ = soundfile.read(f)
+                # audio and mat decoders seek backwards, which is very
+                # slow on compressed members; decompress them en bloc:
+                data, _ = soundfile.read(io.BytesIO(f.read()))
             elif extension == '.mat':
-                name = Path(metadata['_filename']).stem
-                data = scipy.io.loadmat(f)
-                data = data[name]
+                data = scipy.io.loadmat(io.BytesIO(f.read()),
+                                        variable_names=[stored.stem])
+                data = data[stored.stem]
         obj = numpy.asarray(data).view(cls)
         obj._filename = metadata['_filename']
         del metadata['_filename']
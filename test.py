@@ -1,5 +1,6 @@
 import pytest
 import numpy
+import pickle
 from pathlib import Path
 import zipfile
 import soundfile
@@ -63,10 +64,37 @@ def test_arrays(tmp_dataset):
             visited_arrays.append(name)
     assert sorted(visited_arrays) == ['ones', 'twos', 'zeros']
 
+def test_arrays_are_lazy(tmp_dataset):
+    for name, array in tmp_dataset.get_item('first').all_arrays():
+        assert isinstance(array, jbof.LazyArray)
+        assert array.metadata['kind'] == name
+        assert array._array is None # metadata access does not load data
+        numpy.asarray(array)
+        assert array._array is not None
+
+def test_arrays_can_be_pickled(tmp_dataset):
+    array = tmp_dataset.get_item('first').zeros
+    copy = pickle.loads(pickle.dumps(array))
+    assert isinstance(copy, jbof.LazyArray)
+    assert copy.metadata['kind'] == 'zeros'
+    assert numpy.all(copy == 0)
+
+def test_missing_array_raises_attribute_error(tmp_dataset):
+    item = tmp_dataset.get_item('first')
+    with pytest.raises(AttributeError):
+        item.doesnotexist
+    assert not hasattr(item, 'doesnotexist')
+
 def test_create_existing_dataset_raises_error(empty_tmp_dataset):
     with pytest.raises(TypeError):
         jbof.create_dataset('tmp')
 
+def test_add_items(empty_tmp_dataset):
+    items = empty_tmp_dataset.add_items([('one', {'foo': 'bar'}), (None, {'foo': 'baz'})])
+    assert len(items) == 2
+    assert empty_tmp_dataset.has_item('one')
+    assert len(list(empty_tmp_dataset.all_items())) == 2
+
 def test_add_existing_item_raises_error(empty_tmp_dataset):
     e = empty_tmp_dataset.add_item({'kind': 'item1'})
     with pytest.raises(TypeError):
@@ -130,11 +158,59 @@ def test_find_items(empty_tmp_dataset):
     assert set(empty_tmp_dataset.find_items(foo=['bar', 'baz'])) == {e1, e2}
     assert set(empty_tmp_dataset.find_items(foo='quz', raz='boo')) == set()
 
+def test_find_items_with_unhashable_metadata(empty_tmp_dataset):
+    e1 = empty_tmp_dataset.add_item(metadata={'tags': ['red', 'blue']})
+    e2 = empty_tmp_dataset.add_item(metadata={'tags': 'red'})
+    assert set(empty_tmp_dataset.find_items(tags='red')) == {e2}
+
+def test_find_items_after_changes(empty_tmp_dataset):
+    e1 = empty_tmp_dataset.add_item(metadata={'foo': 'bar'})
+    assert set(empty_tmp_dataset.find_items(foo='bar')) == {e1}
+    e2 = empty_tmp_dataset.add_item(metadata={'foo': 'bar'})
+    assert set(empty_tmp_dataset.find_items(foo='bar')) == {e1, e2}
+    empty_tmp_dataset.delete_item(e1)
+    assert set(empty_tmp_dataset.find_items(foo='bar')) == {e2}
+
+def test_to_table(tmp_dataset):
+    table = tmp_dataset.to_table()
+    assert len(table['item']) == 3
+    assert set(table['array']) == {'ones', 'zeros', 'twos'}
+    assert numpy.all(table['kind'] == table['array'])
+
+def test_to_table_rejects_colliding_metadata(empty_tmp_dataset):
+    e = empty_tmp_dataset.add_item()
+    e.add_array('tmp', [], {'item': 'oops'})
+    with pytest.raises(TypeError):
+        empty_tmp_dataset.to_table()
+
+def test_index(tmp_dataset):
+    tmp_dataset.build_index()
+    assert len(list(tmp_dataset.find_items(kind='item'))) == 2
+    tmp_dataset.add_item(name='third', metadata={'kind': 'item'})
+    assert len(list(tmp_dataset.find_items(kind='item'))) == 3
+    # a fresh DataSet must notice that the index is stale:
+    d = jbof.DataSet(tmp_dataset._directory, readonly=False)
+    assert len(list(d.find_items(kind='item'))) == 3
+
+def test_prefetch(tmp_dataset):
+    tmp_dataset.prefetch()
+    assert len(list(tmp_dataset.find_items(kind='item'))) == 2
+    tmp_dataset.prefetch(arrays=True)
+    for name, array in tmp_dataset.get_item('first').all_arrays():
+        assert array.metadata['kind'] == name
+
 def test_hash(empty_tmp_dataset):
     e = empty_tmp_dataset.add_item('tmp')
     e.add_array('tmp', numpy.zeros(5))
     assert '9e9d40c37dc787a96767d314434f4123' == empty_tmp_dataset.calculate_hash()
 
+def test_hash_algorithm(empty_tmp_dataset):
+    e = empty_tmp_dataset.add_item('tmp')
+    e.add_array('tmp', numpy.zeros(5))
+    blake = empty_tmp_dataset.calculate_hash(algorithm='blake2b')
+    assert blake == empty_tmp_dataset.calculate_hash(algorithm='blake2b')
+    assert blake != empty_tmp_dataset.calculate_hash()
+
 def test_readonly(tmp_dataset):
     d = jbof.DataSet(tmp_dataset._directory, readonly=True)
     with pytest.raises(RuntimeError):